@@ -1,10 +1,16 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import pyogrio
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 import os
+import orjson
 import plotly.express as px
 import plotly.graph_objects as go
-from statsmodels.tsa.stattools import acf, pacf
+from demean import demean_groups, unit_month_groups
 
 # Set page config
 st.set_page_config(page_title="Crime Data Dashboard", layout="wide")
@@ -28,94 +34,236 @@ METRIC_COLS = [
     'actual_index_total'
 ]
 
-MONTH_MAP = {
-    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
-    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12
-}
+# Display label per metric column. One fixed categorical dtype keeps the category
+# set (and its codes) identical across every load and cache entry.
+CRIME_TYPE_LABELS = {c: c.replace('actual_', '').replace('_', ' ').title() for c in METRIC_COLS}
+CRIME_TYPE_DTYPE = pd.CategoricalDtype(sorted(CRIME_TYPE_LABELS.values()))
+CRIME_TYPE_COLS = {label: c for c, label in CRIME_TYPE_LABELS.items()}
 
 # --- Utils ---
+# Components already counted by their index; mapping both would double count
+VIOLENT_SUB = frozenset(["Murder", "Rape Total", "Robbery Total", "Assault Aggravated"])
+PROPERTY_SUB = frozenset(["Burglary Total", "Theft Total", "Motor Vehicle Theft Total", "Arson"])
+
 def filter_map_types(selected_types):
-    if not selected_types:
-        return []
     final_types = set(selected_types)
     if "Index Total" in final_types:
         return ["Index Total"]
-    violent_sub = ["Murder", "Rape Total", "Robbery Total", "Assault Aggravated"]
-    property_sub = ["Burglary Total", "Theft Total", "Motor Vehicle Theft Total", "Arson"]
-    if "Index Violent" in final_types:
-        for t in violent_sub:
-            if t in final_types: final_types.remove(t)
-    if "Index Property" in final_types:
-        for t in property_sub:
-            if t in final_types: final_types.remove(t)
-    return list(final_types)
-
-@st.cache_data
-def get_state_mapping():
+    if "Index Violent" in final_types: final_types -= VIOLENT_SUB
+    if "Index Property" in final_types: final_types -= PROPERTY_SUB
+    # Sorted so the same selection always gives the same compute_map cache key
+    return sorted(final_types)
+
+def to_long(parts):
+    """Stack per-type aggregates into the small long frame Plotly expects."""
+    out = pd.concat(parts, ignore_index=True)
+    out['Crime Type'] = out['Crime Type'].astype(CRIME_TYPE_DTYPE)
+    return out
+
+def sum_by_date(frame, types):
+    """Sum each selected metric column per date with one bincount over the factorized dates."""
+    date_codes, dates = pd.factorize(frame['date'], sort=True)
+    valid = date_codes >= 0
+    parts = []
+    for t in sorted(types):
+        values = np.nan_to_num(frame[CRIME_TYPE_COLS[t]].to_numpy(dtype='float64')[valid])
+        sums = np.bincount(date_codes[valid], weights=values, minlength=len(dates))
+        parts.append(pd.DataFrame({'date': np.asarray(dates), 'Crime Type': t, 'Metric_Value': sums}))
+    return to_long(parts)
+
+# Aggregations are keyed on view_key (data version + sidebar selections); the
+# leading underscore stops Streamlit from hashing the multi-million-row frame.
+# The frame is wide: each selected metric column holds that type's Metric_Value.
+@st.cache_data(max_entries=64)
+def compute_trend(_frame, view_key, types):
+    return sum_by_date(_frame, types)
+
+@st.cache_data(max_entries=64)
+def compute_dist(_frame, view_key, types):
+    return to_long([
+        pd.DataFrame({'Crime Type': [t], 'Metric_Value': [_frame[CRIME_TYPE_COLS[t]].sum()]})
+        for t in sorted(types)
+    ])
+
+@st.cache_data(max_entries=64)
+def compute_map(_frame, view_key, map_types, group_col, aggs):
+    map_cols = [CRIME_TYPE_COLS[t] for t in map_types]
+    map_filtered_df = _frame.assign(Metric_Value=_frame[map_cols].sum(axis=1))
+    return map_filtered_df.groupby(group_col, observed=True, sort=False).agg(aggs).reset_index()
+
+def levinson_durbin_pacf(acov, nlags):
+    """Partial autocorrelations from autocovariances by the Levinson-Durbin recursion."""
+    out = np.empty(nlags + 1)
+    out[0] = 1.0
+    phi = np.zeros(nlags + 1)
+    v = acov[0]
+    for k in range(1, nlags + 1):
+        kappa = (acov[k] - phi[1:k] @ acov[k - 1:0:-1]) / v
+        prev = phi[1:k].copy()
+        phi[1:k] = prev - kappa * prev[::-1]
+        phi[k] = kappa
+        v *= 1 - kappa ** 2
+        out[k] = kappa
+    return out
+
+@st.cache_data(max_entries=64)
+def compute_acf_pacf(_series, view_key, target, apply_diff, nlags):
+    """ACF by FFT and Yule-Walker (adjusted) PACF, matching the statsmodels acf/pacf defaults."""
+    x = np.asarray(_series, dtype='float64')
+    x = x - x.mean()
+    n = len(x)
+    size = 1 << (2 * n - 1).bit_length()
+    f = np.fft.rfft(x, size)
+    acov = np.fft.irfft(f * np.conj(f), size)[:nlags + 1]
+    # "adjusted" autocovariance divides lag k by n - k
+    return acov / acov[0], levinson_durbin_pacf(acov / (n - np.arange(nlags + 1)), nlags)
+
+def format_hover(title, fields):
+    """One preformatted hover string per feature; the trace's hovertemplate only echoes it."""
+    text = "<b>" + title.astype('string').fillna('') + "</b>"
+    for label, values in fields.items():
+        text = text + f"<br>{label}=" + values.astype('string').fillna('')
+    return text.to_numpy(dtype=object)
+
+# Beyond this many bars the per-bar labels are dropped and values stay in the hover
+MAX_BAR_LABELS = 6
+
+def format_short(v):
+    """Compact bar label, e.g. 1.2M / 35k / 12.5."""
+    a = abs(v)
+    if a >= 1e6: return f"{v/1e6:.1f}M"
+    if a >= 1e3: return f"{v/1e3:.0f}k"
+    if a < 0.05: return "0"
+    return f"{v:.1f}"
+
+def session_figure(name, token, build):
+    """Reuse a figure across reruns while its structure (token) is unchanged; callers update the data in place."""
+    cached = st.session_state.get(name)
+    if cached is None or cached[0] != token:
+        cached = (token, build())
+        st.session_state[name] = cached
+    return cached[1]
+
+# Heavy frames are process-wide singletons (no per-session copy); callers must treat them as read-only
+@st.cache_resource
+def _load_all_places():
+    """Read every place once per process and index row positions by STATEFP."""
+    # GeoParquet written by prepare_deployment.py; skips the GeoJSON parse entirely
+    parquet_path = os.path.join(DATA_DIR, "us_places.parquet")
     geo_path = os.path.join(DATA_DIR, "us_places.geojson")
-    if not os.path.exists(geo_path): return pd.DataFrame()
-    try:
-        gdf = gpd.read_file(geo_path, encoding='latin-1', ignore_geometry=True)
-    except:
-         gdf = gpd.read_file(geo_path, encoding='latin-1')
-    if 'STATEFP' in gdf.columns and 'STATE_NAME' in gdf.columns:
-        return gdf[['STATE_NAME', 'STUSPS', 'STATEFP']].drop_duplicates().sort_values('STATE_NAME')
-    return pd.DataFrame()
+    if os.path.exists(parquet_path):
+        # Memory-mapped: the OS page cache serves the bytes and pyarrow decodes straight from them
+        with pa.memory_map(parquet_path, 'r') as source:
+            gdf = gpd.read_parquet(source)
+    elif os.path.exists(geo_path):
+        # Build step not run (the Parquet is not committed): read the committed GeoJSON as before
+        gdf = pyogrio.read_dataframe(
+            geo_path, encoding='latin-1',
+            columns=['STATEFP', 'STUSPS', 'STATE_NAME', 'NAME', 'GEOID']
+        )
+        gdf['GEOID'] = gdf['GEOID'].astype('int32')
+    else:
+        return None, {}
+    gdf['NAME'] = gdf['NAME'].str.title()
+    return gdf, gdf.groupby('STATEFP').indices
 
-@st.cache_data
+@st.cache_resource
+def get_state_mapping():
+    # Derived from the shared places frame; the ~50-row result is cached on its own
+    gdf, _ = _load_all_places()
+    if gdf is None: return pd.DataFrame()
+    return gdf[['STATE_NAME', 'STUSPS', 'STATEFP']].drop_duplicates().sort_values('STATE_NAME')
+
+@st.cache_resource
+def state_centers():
+    """STATEFP -> (lat, lon) map center, precomputed by prepare_deployment.py."""
+    centers_path = os.path.join(DATA_DIR, "state_centers.parquet")
+    if not os.path.exists(centers_path): return {}
+    with pa.memory_map(centers_path, 'r') as source:
+        centers = pq.read_table(source).to_pandas()
+    return {fp: (float(lat), float(lon)) for fp, lat, lon in centers[['STATEFP', 'center_lat', 'center_lon']].itertuples(index=False)}
+
+@st.cache_resource
 def load_geo_data(state_fp):
-    geo_path = os.path.join(DATA_DIR, "us_places.geojson")
-    if not os.path.exists(geo_path): return None
-    gdf = gpd.read_file(geo_path, encoding='latin-1')
-    state_gdf = gdf[gdf['STATEFP'] == state_fp].copy()
-    state_gdf['NAME'] = state_gdf['NAME'].str.title()
-    return state_gdf
+    """A state's places and their GeoJSON dict, built once and shared across reruns."""
+    gdf, rows_by_state = _load_all_places()
+    if gdf is None: return None, None
+    state_gdf = gdf.iloc[rows_by_state.get(state_fp, [])]
+    # Prebuilt by prepare_deployment.py; orjson parses it far faster than stdlib json
+    geojson_path = os.path.join(DATA_DIR, "places", f"places_{state_fp}.json")
+    if os.path.exists(geojson_path):
+        with open(geojson_path, 'rb') as fh:
+            return state_gdf, orjson.loads(fh.read())
+    return state_gdf, orjson.loads(state_gdf[['GEOID', 'geometry']].to_json(drop_id=True))
+
+@st.cache_resource
+def state_center(state_fp):
+    """(lat, lon) for one state's map: the precomputed center, else the mean place point as the build computes it."""
+    center = state_centers().get(state_fp)
+    if center is not None: return center
+    state_gdf, _ = load_geo_data(state_fp)
+    # Fall back to the middle of the contiguous US if the state has no places at all
+    if state_gdf is None or state_gdf.empty: return (39.8, -98.6)
+    rep_points = state_gdf.geometry.representative_point()
+    return float(rep_points.y.mean()), float(rep_points.x.mean())
+
+def crime_shard_path(state_abbr=None, national=False):
+    # Built by prepare_deployment.py: hive-partitioned by state_abb plus pre-summed crime_national.parquet beside it.
+    # The state's partition file is opened by path, so no directory discovery is needed.
+    if national: return os.path.join(DATA_DIR, "crime_national.parquet")
+    return os.path.join(DATA_DIR, "crime_data", f"state_abb={state_abbr}", "part-0.parquet")
 
 @st.cache_data
-def load_crime_data_long(state_abbr=None, national=False):
-    parquet_path = os.path.join(DATA_DIR, "crime_data_optimized.parquet")
-    if not os.path.exists(parquet_path):
+def shard_info(state_abbr=None, national=False, mtime=None):
+    """Year bounds and metric columns, read from the shard's Parquet footer alone."""
+    shard_path = crime_shard_path(state_abbr, national)
+    if not os.path.exists(shard_path): return None
+    with pa.memory_map(shard_path, 'r') as source:
+        meta = pq.ParquetFile(source).metadata
+    names = meta.schema.to_arrow_schema().names
+    year_ix = names.index('year')
+    stats = [meta.row_group(i).column(year_ix).statistics for i in range(meta.num_row_groups)]
+    if not stats: return None
+    return {
+        'min_year': int(min(s.min for s in stats)),
+        'max_year': int(max(s.max for s in stats)),
+        'metrics': [c for c in METRIC_COLS if c in names],
+    }
+
+@st.cache_resource(max_entries=16)
+def load_crime_data(state_abbr=None, national=False, mtime=None, start_year=None, end_year=None, metric_cols=()):
+    """Scan only the selected years and metric columns of one state's (or the national) shard.
+
+    mtime is only part of the cache key, so rebuilding the data invalidates the entry.
+    """
+    shard_path = crime_shard_path(state_abbr, national)
+    if not os.path.exists(shard_path):
         st.error("Data file not found.")
-        return pd.DataFrame()
+        return None
 
     try:
-        if national:
-            df = pd.read_parquet(parquet_path)
-            cols = [c for c in METRIC_COLS if c in df.columns]
-            if 'population' in df.columns: cols.append('population') 
-            df = df.groupby(['state_abb', 'year', 'month'])[cols].sum().reset_index()
-            
-        else:
-            filters = [('state_abb', '==', state_abbr)] if state_abbr else None
-            df = pd.read_parquet(parquet_path, filters=filters)
-
-        if df.empty: return pd.DataFrame()
-
-        df['month_lower'] = df['month'].astype(str).str.lower()
-        df['month_num'] = df['month_lower'].map(MONTH_MAP)
-        df = df.dropna(subset=['month_num'])
-        df['month_num'] = df['month_num'].astype(int)
-        df['month_str'] = df['month_num'].astype(str).str.zfill(2)
-        df['date'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month_str'] + '-01', errors='coerce')
-
-        if not national:
-            df['fips_state_clean'] = pd.to_numeric(df['fips_state_code'], errors='coerce').fillna(0).astype(int).astype(str).str.zfill(2)
-            df['fips_place_clean'] = pd.to_numeric(df['fips_place_code'], errors='coerce').fillna(0).astype(int).astype(str).str.zfill(5)
-            df['GEOID'] = df['fips_state_clean'] + df['fips_place_clean']
-            df['agency_name'] = df['agency_name'].str.title()
+        # state_abb comes back from the partition directory name; Polars memory-maps local files itself
+        lf = pl.scan_parquet(shard_path, hive_partitioning=not national)
+        file_columns = lf.collect_schema().names()
 
+        # Stays wide (one column per metric): melting would repeat every id column once per crime type
         id_vars = ['year', 'month_num', 'date']
-        if 'population' in df.columns: id_vars.append('population')
+        if 'population' in file_columns: id_vars.append('population')
         if national: id_vars += ['state_abb']
         else: id_vars += ['agency_name', 'state_abb', 'GEOID']
 
-        existing_metrics = [c for c in METRIC_COLS if c in df.columns]
-        df_long = df.melt(id_vars=id_vars, value_vars=existing_metrics, var_name='Crime Type', value_name='Incidents')
-        df_long['Crime Type'] = df_long['Crime Type'].str.replace('actual_', '').str.replace('_', ' ').str.title()
-        return df_long
+        # Year predicate and projection go to the Parquet reader, which skips row groups by min/max stats
+        cat_cols = [c for c in ('agency_name', 'state_abb') if c in id_vars]
+        frame = (
+            lf.filter(pl.col('year').is_between(start_year, end_year))
+            .select(id_vars + [c for c in metric_cols if c in file_columns])
+            .with_columns(pl.col(cat_cols).cast(pl.Categorical))
+            .collect(engine="streaming")
+        )
+        return frame if frame.height else None
     except Exception as e:
         st.error(f"Error loading data: {e}")
-        return pd.DataFrame()
+        return None
 
 # --- Sidebar ---
 st.sidebar.header("Data Configuration")
@@ -125,39 +273,38 @@ selected_state_name = None
 state_abbr = None
 state_fp = None
 
-if analysis_level == "State Level":
-    with st.spinner("Loading..."):
-        state_map = get_state_mapping()
+# Fetched once per run and shared by both levels (a cache_resource reference, no copy)
+with st.spinner("Loading..."):
+    state_map = get_state_mapping()
+
+national = analysis_level == "National Level"
+gdf = None
+if not national:
+    # The national view works off state abbreviations alone; only the state list needs places
+    if state_map.empty:
+        st.error("Place data not found: dashboard/us_places.geojson is missing.")
+        st.stop()
     state_options = state_map['STATE_NAME'].tolist()
     default_ix = state_options.index("Alabama") if "Alabama" in state_options else 0
     selected_state_name = st.sidebar.selectbox("Select State", state_options, index=default_ix)
     state_row = state_map[state_map['STATE_NAME'] == selected_state_name].iloc[0]
     state_abbr = state_row['STUSPS']
     state_fp = state_row['STATEFP']
-    with st.spinner("Fetching Data..."):
-        df = load_crime_data_long(state_abbr=state_abbr, national=False)
-        gdf = load_geo_data(state_fp)
-else:
-    with st.spinner("Fetching Data..."):
-        df = load_crime_data_long(national=True)
-        state_map = get_state_mapping()
-        if not state_map.empty:
-             df = df.merge(state_map[['STATE_NAME', 'STUSPS']], left_on='state_abb', right_on='STUSPS', how='left')
-             df.rename(columns={'STATE_NAME': 'State Name'}, inplace=True)
-        else: df['State Name'] = df['state_abb']
-    gdf = None
-
-if df.empty:
+
+shard_path = crime_shard_path(state_abbr, national)
+mtime = os.path.getmtime(shard_path) if os.path.exists(shard_path) else None
+data_version = (state_abbr, national, mtime)
+info = shard_info(state_abbr, national, mtime)
+if info is None:
     st.error("No data available.")
     st.stop()
 
 st.sidebar.subheader("Time Filters")
-min_year = int(df['year'].min())
-max_year = int(df['year'].max())
+min_year, max_year = info['min_year'], info['max_year']
 start_year, end_year = st.sidebar.slider("Year Range", min_year, max_year, (min_year, max_year))
 
 st.sidebar.subheader("Crime Types")
-available_types = sorted(df['Crime Type'].unique())
+available_types = sorted(CRIME_TYPE_LABELS[c] for c in info['metrics'])
 default_types = ["Index Total", "Index Violent"]
 defaults = [t for t in default_types if t in available_types]
 if not defaults: defaults = [available_types[0]]
@@ -175,60 +322,48 @@ metric_choice = st.sidebar.radio("Map Metric Scale", ["Total Incidents", "Crime
 use_fixed_effects = st.sidebar.checkbox("De-mean Monthly Regional Effects")
 st.sidebar.caption("Subtracts the average value for each month (Jan-Dec) specific to each geographic unit to remove seasonality.")
 
+view_key = (data_version, start_year, end_year, tuple(selected_types), metric_choice, use_fixed_effects)
+
 # --- Data Processing (FE) ---
 
-filtered_df = df[
-    (df['year'] >= start_year) & 
-    (df['year'] <= end_year) & 
-    (df['Crime Type'].isin(selected_types))
-].copy()
+# Only the selected crime types' columns are read; each one holds
+# Incidents and is converted in place into that type's Metric_Value below.
+sel_cols = [CRIME_TYPE_COLS[t] for t in selected_types]
+with st.spinner("Fetching Data..."):
+    frame = load_crime_data(
+        state_abbr=state_abbr, national=national, mtime=mtime,
+        start_year=start_year, end_year=end_year, metric_cols=tuple(sorted(sel_cols))
+    )
+    if not national: gdf, state_geojson = load_geo_data(state_fp)
 
-if use_fixed_effects:
-    # Calculate Monthly Means per Unit
-    # Unit ID depends on level: National=state_abb, State=GEOID
-    unit_col = 'state_abb' if analysis_level == "National Level" else 'GEOID'
-    
-    # We calculate the mean for each (Unit, Month, Crime Type) tuple
-    # This represents the "seasonal norm" for that unit and crime
-    monthly_means = filtered_df.groupby([unit_col, 'month_num', 'Crime Type'])['Incidents'].transform('mean')
-    
-    # De-mean
-    filtered_df['Incidents_Raw'] = filtered_df['Incidents']
-    filtered_df['Incidents'] = filtered_df['Incidents'] - monthly_means
-    
-    # Note on Population for Rate de-meaning?
-    # Usually we de-mean the outcome variable. 
-    # If the user selects Rate, we should probably de-mean the Rate, not the Count.
-    # Refinement: Calculate Rate first, then De-mean the Rate/Count.
-    
-    # Let's adjust logic: Calculate Metric First (Count or Rate), then De-mean that metric.
+if frame is None:
+    st.error("No data available.")
+    st.stop()
 
-# Recalculate 'Value' for analysis based on Metric Choice
-def calculate_metric(row):
-    val = row['Incidents']
-    pop = row['population'] if 'population' in row else 0
-    
-    if use_fixed_effects and 'Incidents_Raw' in row:
-        # If we already demeaned incidents, we use that for "Total Incidents" mode
-        # But for Rate mode, we need to demean the rate.
-        pass # handled below block in vectorized way
-    return val
+# The cached Polars frame is shared; pandas gets a fresh copy to mutate
+filtered_df = frame.to_pandas()
+if national:
+    if not state_map.empty:
+        # Renaming the categories keeps the names as codes, so groupby 'first' never touches strings
+        names = dict(zip(state_map['STUSPS'], state_map['STATE_NAME']))
+        filtered_df['State Name'] = filtered_df['state_abb'].cat.rename_categories(lambda abb: names.get(abb, abb))
+    else: filtered_df['State Name'] = filtered_df['state_abb']
+filtered_df[sel_cols] = filtered_df[sel_cols].astype('float64')
 
 # Standardize Metric Calculation
 if metric_choice == "Crime Rate (per 100k Population)":
-    # Rate = (Count / Pop) * 100k
-    # Avoid zero div
-    filtered_df['Metric_Value'] = (filtered_df['Incidents'] / filtered_df['population'].replace(0, 1)) * 100000
-    filtered_df.loc[filtered_df['population'] == 0, 'Metric_Value'] = 0
-else:
-    filtered_df['Metric_Value'] = filtered_df['Incidents']
+    # Rate = (Count / Pop) * 100k, and 0 where there is no population
+    pop = filtered_df['population'].to_numpy()[:, None]
+    counts = filtered_df[sel_cols].to_numpy()
+    filtered_df[sel_cols] = np.where(pop > 0, counts / np.where(pop > 0, pop, 1) * 100000.0, 0.0)
 
-# Apply FE to the Metric_Value directly
+# Apply FE to the Metric_Value directly (after the rate, so a rate is de-meaned as a rate)
 if use_fixed_effects:
+    # Unit ID depends on level: National=state_abb, State=GEOID
     unit_col = 'state_abb' if analysis_level == "National Level" else 'GEOID'
-    # Re-calculate means on the *Metric_Value*
-    monthly_means_metric = filtered_df.groupby(['month_num', 'Crime Type'])['Metric_Value'].transform('mean')
-    filtered_df['Metric_Value'] = filtered_df['Metric_Value'] - monthly_means_metric
+    # The (Unit, Month) mean of each crime type column is that unit's "seasonal norm"
+    group_ids, n_groups = unit_month_groups(filtered_df[unit_col], filtered_df['month_num'])
+    filtered_df[sel_cols] = demean_groups(group_ids, filtered_df[sel_cols].to_numpy(dtype='float64'), n_groups)
 
 
 # --- Visualizations ---
@@ -242,16 +377,24 @@ with col_trend:
     # Summing Metric Values across all units for the timeline?
     # If FE is on, Sum of (Value - Mean) might be close to zero if frames align, 
     # but informative if looking at deviations.
-    trend_df = filtered_df.groupby(['date', 'Crime Type'])['Metric_Value'].sum().reset_index()
+    trend_df = compute_trend(filtered_df, view_key, selected_types)
     
     y_label = "De-meaned Value" if use_fixed_effects else metric_choice
     
-    fig_trend = px.line(
-        trend_df, x='date', y='Metric_Value', color='Crime Type',
-        title=f"Trends ({y_label})",
-        labels={'date': 'Date', 'Metric_Value': y_label}
-    )
+    # One line trace per type; rebuilt only when the set of types changes
+    trend_types = sorted(selected_types)
+    fig_trend = session_figure("trend_fig", tuple(trend_types), lambda: go.Figure(
+        [go.Scatter(mode='lines', name=t, legendgroup=t) for t in trend_types],
+        layout=dict(legend_title_text='Crime Type', xaxis_title='Date')
+    ))
+    for trace in fig_trend.data:
+        series = trend_df[trend_df['Crime Type'] == trace.name]
+        trace.x = series['date'].to_numpy()
+        trace.y = series['Metric_Value'].to_numpy()
+        trace.hovertemplate = f"Crime Type={trace.name}<br>Date=%{{x}}<br>{y_label}=%{{y}}<extra></extra>"
+    fig_trend.update_layout(title_text=f"Trends ({y_label})", yaxis_title=y_label)
     # Add horizontal zero line for FE
+    fig_trend.layout.shapes = ()
     if use_fixed_effects:
         fig_trend.add_hline(y=0, line_dash="dash", line_color="gray")
     
@@ -261,13 +404,16 @@ with col_trend:
 with col_dist:
     st.subheader("Distribution")
     # Note: If FE is on, this shows net deviation from seasonal norm
-    dist_df = filtered_df.groupby(['Crime Type'])['Metric_Value'].sum().reset_index()
-    fig_dist = px.bar(
-        dist_df, x='Crime Type', y='Metric_Value', color='Crime Type',
-        title=f"Total {y_label}",
-        text_auto=True
-    )
-    fig_dist.update_layout(showlegend=False, xaxis_title="Crime Type", yaxis_title=y_label)
+    dist_df = compute_dist(filtered_df, view_key, selected_types)
+    fig_dist = session_figure("dist_fig", tuple(trend_types), lambda: go.Figure(
+        [go.Bar(name=t, x=[t]) for t in trend_types],
+        layout=dict(showlegend=False, xaxis_title="Crime Type", barmode='relative')
+    ))
+    for trace in fig_dist.data:
+        trace.y = dist_df.loc[dist_df['Crime Type'] == trace.name, 'Metric_Value'].to_numpy()
+        trace.text = [format_short(v) for v in trace.y] if len(fig_dist.data) <= MAX_BAR_LABELS else None
+        trace.hovertemplate = f"Crime Type={trace.name}<br>{y_label}=%{{y}}<extra></extra>"
+    fig_dist.update_layout(title_text=f"Total {y_label}", yaxis_title=y_label)
     st.plotly_chart(fig_dist, width="stretch")
 
 
@@ -275,7 +421,6 @@ with col_dist:
 st.subheader("Geospatial Distribution")
 
 map_types = filter_map_types(selected_types)
-map_filtered_df = filtered_df[filtered_df['Crime Type'].isin(map_types)].copy()
 
 if len(map_types) < len(selected_types):
     removed = set(selected_types) - set(map_types)
@@ -294,56 +439,72 @@ else:
 # Add extraCols
 extras = {}
 if analysis_level == "National Level":
-    if 'State Name' in map_filtered_df.columns: extras['State Name'] = 'first'
+    if 'State Name' in filtered_df.columns: extras['State Name'] = 'first'
 else:
     extras['agency_name'] = 'first'
 
 aggs.update(extras)
 
-map_df = map_filtered_df.groupby(group_col).agg(aggs).reset_index()
+map_df = compute_map(filtered_df, view_key, map_types, group_col, aggs)
 
 # Color Scale logic: If FE, use diverging. Else sequential.
 color_scale = "RdBu_r" if use_fixed_effects else "Reds"
 # For RdBu_r, 0 should be middle.
 cmid = 0 if use_fixed_effects else None
 
-hover_name = 'State Name' if analysis_level == "National Level" and 'State Name' in map_df.columns else ('agency_name' if 'agency_name' in map_df.columns else group_col)
-hover_cols = {'Metric_Value': True, 'population': True}
-
 if analysis_level == "National Level":
     fig_map = px.choropleth(
         map_df,
         locations='state_abb',
         locationmode="USA-states",
         color='Metric_Value',
-        hover_name=hover_name,
-        hover_data=hover_cols,
         scope="usa",
         color_continuous_scale=color_scale,
         color_continuous_midpoint=cmid,
         title=f"{y_label} by State"
     )
+    title_col = 'State Name' if 'State Name' in map_df.columns else 'state_abb'
+    fig_map.update_traces(
+        hovertext=format_hover(map_df[title_col], {
+            'Metric_Value': map_df['Metric_Value'].round(1),
+            'population': map_df['population'].round().astype('Int64'),
+        }),
+        hovertemplate="%{hovertext}<extra></extra>"
+    )
 else:
     if gdf is not None and not gdf.empty:
         merged_gdf = gdf.merge(map_df, on='GEOID', how='left')
         merged_gdf['Metric_Value'] = merged_gdf['Metric_Value'].fillna(0)
-        
-        centroid = merged_gdf.geometry.centroid
-        fig_map = px.choropleth_mapbox(
-            merged_gdf,
-            geojson=merged_gdf.geometry.__geo_interface__,
-            locations=merged_gdf.index,
-            color='Metric_Value',
-            hover_name='NAME',
-            hover_data=extras,
-            color_continuous_scale=color_scale,
-            color_continuous_midpoint=cmid,
-            mapbox_style="carto-positron",
-            center={"lat": centroid.y.mean(), "lon": centroid.x.mean()},
-            zoom=6,
-            opacity=0.6,
-            title=f"{y_label} by Place"
+
+        center_lat, center_lon = state_center(state_fp)
+        # Geometry, locations and layout are built once per state; reruns only swap z and styling
+        fig_map = session_figure("state_map_fig", state_fp, lambda: go.Figure(
+            go.Choroplethmapbox(
+                geojson=state_geojson,
+                featureidkey='properties.GEOID',
+                locations=merged_gdf['GEOID'].to_numpy(),
+                z=np.zeros(len(merged_gdf)),
+                marker_opacity=0.6,
+                colorbar_title_text='Metric_Value'
+            ),
+            layout=dict(
+                mapbox_style="carto-positron",
+                mapbox_center={"lat": center_lat, "lon": center_lon},
+                mapbox_zoom=6
+            )
+        ))
+        fig_map.update_traces(
+            z=merged_gdf['Metric_Value'].to_numpy(),
+            hovertext=format_hover(merged_gdf['NAME'], {
+                'agency_name': merged_gdf['agency_name'],
+                'Metric_Value': merged_gdf['Metric_Value'].round(1),
+                'population': merged_gdf['population'].round().astype('Int64'),
+            }),
+            hovertemplate="%{hovertext}<extra></extra>",
+            colorscale=color_scale,
+            zmid=cmid
         )
+        fig_map.update_layout(title_text=f"{y_label} by Place")
     else:
         fig_map = None
 
@@ -367,7 +528,7 @@ with st.expander("Show Autocorrelation Plots", expanded=True):
     
     # Prepare Data
     # Filter for single series (Aggregate over all units for the selected analysis level)
-    ts_data = filtered_df[filtered_df['Crime Type'] == target_series_type].groupby('date')['Metric_Value'].sum().sort_index()
+    ts_data = filtered_df.groupby('date')[CRIME_TYPE_COLS[target_series_type]].sum().sort_index()
     
     if apply_diff:
         ts_data = ts_data.diff().dropna()
@@ -376,17 +537,17 @@ with st.expander("Show Autocorrelation Plots", expanded=True):
     if len(ts_data) > 2:
         lags = min(40, len(ts_data)//2 - 1)
         
+        acf_vals, pacf_vals = compute_acf_pacf(ts_data.to_numpy(), view_key, target_series_type, apply_diff, lags)
+
         # ACF
-        acf_vals = acf(ts_data, nlags=lags)
         fig_acf = px.bar(x=list(range(len(acf_vals))), y=acf_vals, labels={'x':'Lag', 'y':'Autocorrelation'}, title=f"ACF: {target_series_type}")
         fig_acf.update_yaxes(range=[-1.1, 1.1])
         
         # PACF
-        try:
-            pacf_vals = pacf(ts_data, nlags=lags)
+        if np.isfinite(pacf_vals).all():
             fig_pacf = px.bar(x=list(range(len(pacf_vals))), y=pacf_vals, labels={'x':'Lag', 'y':'Partial Autocorrelation'}, title=f"PACF: {target_series_type}")
             fig_pacf.update_yaxes(range=[-1.1, 1.1])
-        except:
+        else:
              fig_pacf = None
              st.warning("Not enough data points for PACF.")
 
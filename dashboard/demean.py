@@ -0,0 +1,36 @@
+import numpy as np
+from numba import config, njit, prange
+
+# Streamlit calls this from its script threads; the TBB pool can block interpreter
+# shutdown there, so prefer OpenMP when it is available
+config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+
+# Lives outside app.py so the compiled kernel survives Streamlit reruns (the script
+# is re-executed each time, an imported module is not); cache=True keeps it across restarts.
+
+
+@njit(parallel=True, cache=True)
+def demean_groups(group_ids, values, n_groups):
+    """Subtract each group's column means from a (rows, columns) float64 array."""
+    n_rows, n_cols = values.shape
+    sums = np.zeros((n_groups, n_cols))
+    counts = np.zeros(n_groups)
+    # Accumulate serially: parallel += on shared group slots would race
+    for i in range(n_rows):
+        g = group_ids[i]
+        counts[g] += 1
+        for j in range(n_cols):
+            sums[g, j] += values[i, j]
+    out = np.empty_like(values)
+    for i in prange(n_rows):
+        g = group_ids[i]
+        for j in range(n_cols):
+            out[i, j] = values[i, j] - sums[g, j] / counts[g]
+    return out
+
+
+def unit_month_groups(units, month_num):
+    """Dense int64 group id per row for (unit, month 1-12)."""
+    unit_codes = np.asarray(units.factorize()[0], dtype=np.int64)
+    n_units = int(unit_codes.max()) + 1 if len(unit_codes) else 0
+    return unit_codes * 12 + (np.asarray(month_num, dtype=np.int64) - 1), n_units * 12
@@ -1,10 +1,18 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import pyogrio
 import os
+import shutil
 import glob
 
 # Config
-DATA_DIR = r"c:\Users\Kaiyan Zhang\Desktop\ntl_crime\data"
-OUTPUT_DIR = r"c:\Users\Kaiyan Zhang\Desktop\ntl_crime\dashboard"
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+OUTPUT_DIR = os.path.join(ROOT_DIR, "dashboard")
 METRIC_COLS = [
     'actual_murder', 
     'actual_rape_total', 
@@ -19,63 +27,170 @@ METRIC_COLS = [
     'actual_index_total'
 ]
 ID_COLS = ['state_abb', 'year', 'month', 'agency_name', 'fips_state_code', 'fips_place_code', 'population']
+MONTH_MAP = {
+    'january': 1, 'february': 2, 'march': 3, 'april': 4, 'may': 5, 'june': 6,
+    'july': 7, 'august': 8, 'september': 9, 'october': 10, 'november': 11, 'december': 12
+}
+# Hive layout, one file per state (crime_data/state_abb=AL/part-0.parquet), plus a pre-summed crime_national.parquet beside it
+SHARD_ROW_GROUP_SIZE = 256_000
+
+START_YEAR, END_YEAR = 2012, 2024
+ID_TYPES = {'state_abb': pa.string(), 'month': pa.string(), 'agency_name': pa.string()}
+
+# Plain, signed, decimal or scientific notation: what pd.to_numeric parses for these columns
+NUMERIC_RE = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+def to_int32(arr):
+    """Coerce a CSV column to int32; unparseable cells become 0 (pd.to_numeric(errors='coerce').fillna(0)).
+
+    The final cast is safe: a fractional or out-of-range value fails the build instead of being truncated.
+    """
+    if pa.types.is_null(arr.type):
+        # Column missing from this file: stays null, as a pandas concat would leave it
+        return pc.cast(arr, pa.int32())
+    if pa.types.is_string(arr.type):
+        arr = pc.utf8_trim_whitespace(arr)
+        arr = pc.if_else(pc.match_substring_regex(arr, NUMERIC_RE), arr, pa.scalar(None, pa.string()))
+    arr = pc.fill_null(pc.cast(arr, pa.float64()), 0)
+    return pc.cast(arr, pa.int32())
+
+def read_year_csv(path):
+    """One year's CSV through pyarrow's multithreaded reader, typed and trimmed to the columns we keep."""
+    convert = pacsv.ConvertOptions(
+        include_columns=ID_COLS + METRIC_COLS, include_missing_columns=True, column_types=ID_TYPES,
+        # Empty/NA strings are nulls, as pandas reads them
+        strings_can_be_null=True
+    )
+    table = pacsv.read_csv(path, convert_options=convert)
+    for c in METRIC_COLS + ['population', 'fips_state_code', 'fips_place_code']:
+        table = table.set_column(table.column_names.index(c), c, to_int32(table[c]))
+    return table.set_column(table.column_names.index('year'), 'year', pc.cast(table['year'], pa.int16()))
 
 def create_optimized_dataset():
     crime_folder = os.path.join(DATA_DIR, "offenses_known_csv_1960_2024_month")
-    all_files = glob.glob(os.path.join(crime_folder, "*.csv"))
-    
-    dfs = []
-    
     # Only load 2012-2024 to save space as per user dashboard scope
     # Filenames are offenses_known_monthly_YYYY.csv
-    
+    files = [f for year in range(START_YEAR, END_YEAR + 1) for f in glob.glob(os.path.join(crime_folder, f"*_{year}.csv"))]
+
     print("Processing CSVs...")
-    for f in all_files:
-        filename = os.path.basename(f)
-        try:
-            year = int(filename.split('_')[-1].split('.')[0])
-            if year < 2012 or year > 2024:
-                continue
-        except:
-            continue
-            
-        print(f"Loading {filename}...")
+    tables = []
+    failed = []
+    for f in files:
+        print(f"Loading {os.path.basename(f)}...")
         try:
-            # Check cols first
-            header = pd.read_csv(f, nrows=0).columns.tolist()
-            available_cols = [c for c in ID_COLS + METRIC_COLS if c in header]
-            
-            # Load subset
-            df = pd.read_csv(f, usecols=available_cols)
-            
-            # Optimize types
-            # metrics -> int32 or float32
-            # population -> float32
-            for c in df.columns:
-                if 'actual_' in c or c == 'population':
-                    df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0)
-                if 'fips' in c:
-                     df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0).astype(int)
-
-            dfs.append(df)
+            tables.append(read_year_csv(f))
         except Exception as e:
-            print(f"Error {filename}: {e}")
+            print(f"Error {os.path.basename(f)}: {e}")
+            failed.append(os.path.basename(f))
+
+    # A missing year would silently shrink every shard; stop before the old dataset is removed
+    if failed:
+        raise RuntimeError(f"Could not read {', '.join(failed)}; existing dataset left untouched")
 
-    if not dfs:
+    if not tables:
         print("No data found.")
         return
 
-    print("Concatenating...")
-    full_df = pd.concat(dfs, ignore_index=True)
-    
+    # Zero-copy: the result just references every file's chunks
+    table = pa.concat_tables(tables)
+    del tables
+    # Metrics no source file has (the CSV reader fills them with nulls) are left out, as before
+    table = table.drop_columns([c for c in METRIC_COLS if table[c].null_count == table.num_rows])
+
+    # Calendar columns are built once here instead of string-parsed on every dashboard load
+    month_ix = pc.index_in(pc.utf8_lower(table['month']), value_set=pa.array(list(MONTH_MAP)))
+    month_num = pc.take(pa.array(list(MONTH_MAP.values()), pa.int8()), month_ix)
+    # month_num/date replace the raw month name; no reader needs the string
+    table = table.drop_columns(['month']).append_column('month_num', month_num)
+    table = table.filter(pc.field('month_num').is_valid())
+    months = (table['year'].to_numpy().astype('int64') - 1970) * 12 + table['month_num'].to_numpy() - 1
+    table = table.append_column('date', pa.array(months.astype('datetime64[M]').astype('datetime64[D]')))
+
+    # Join key for us_places GEOID: SSPPPPP as an integer (state * 100000 + place)
+    geoid = pc.add(pc.multiply(table['fips_state_code'], 100000), table['fips_place_code'])
+    table = table.append_column('GEOID', pc.cast(geoid, pa.int32()))
+    table = table.set_column(table.column_names.index('agency_name'), 'agency_name', pc.utf8_title(table['agency_name']))
+
     print("Saving to Parquet...")
-    # Use compression to minimize size
-    output_path = os.path.join(OUTPUT_DIR, "crime_data_optimized.parquet")
-    full_df.to_parquet(output_path, index=False, compression='brotli')
-    
-    size_mb = os.path.getsize(output_path) / (1024 * 1024)
-    print(f"Saved optimized parquet to {output_path}")
+    output_path = os.path.join(OUTPUT_DIR, "crime_data")
+
+    # Rows without a state would only land in a null partition no view reads
+    table = table.filter(pc.field('state_abb').is_valid())
+    # Each agency's series is contiguous and in time order within its state, so readers can
+    # aggregate in streaming passes; the order is recorded in the footer via sorting_columns
+    ordering = [('agency_name', 'ascending'), ('year', 'ascending'), ('month_num', 'ascending')]
+    table = table.sort_by([('state_abb', 'ascending')] + ordering)
+    # Indices are into the file schema, which excludes the state_abb partition key
+    file_sorting = pq.SortingColumn.from_ordering(table.drop_columns(['state_abb']).schema, ordering)
+
+    # Rebuild from scratch so partitions of states dropped from the source don't linger
+    shutil.rmtree(output_path, ignore_errors=True)
+    # One partitioned pass instead of a filter per state; preserve_order keeps the year sort
+    ds.write_dataset(
+        table, output_path, format='parquet',
+        partitioning=['state_abb'], partitioning_flavor='hive',
+        basename_template='part-{i}.parquet', preserve_order=True,
+        min_rows_per_group=SHARD_ROW_GROUP_SIZE, max_rows_per_group=SHARD_ROW_GROUP_SIZE,
+        # zstd decodes several times faster than brotli at a similar ratio
+        file_options=ds.ParquetFileFormat().make_write_options(
+            compression='zstd', compression_level=3, sorting_columns=list(file_sorting)
+        )
+    )
+
+    # National view is per-state monthly sums; do them here rather than on every dashboard load
+    sum_cols = [c for c in METRIC_COLS + ['population'] if c in table.column_names]
+    national = table.group_by(['state_abb', 'year', 'month_num', 'date']).aggregate([(c, 'sum') for c in sum_cols])
+    national = national.rename_columns([c.removesuffix('_sum') for c in national.column_names])
+    national_ordering = [('state_abb', 'ascending'), ('year', 'ascending'), ('month_num', 'ascending')]
+    national = national.sort_by(national_ordering)
+    # Beside the dataset root, not inside it, so scanning crime_data/ as a dataset counts each row once
+    national_path = os.path.join(OUTPUT_DIR, "crime_national.parquet")
+    pq.write_table(
+        national, national_path,
+        compression='zstd', compression_level=3, row_group_size=SHARD_ROW_GROUP_SIZE,
+        sorting_columns=pq.SortingColumn.from_ordering(national.schema, national_ordering)
+    )
+
+    shard_files = glob.glob(os.path.join(output_path, "**", "*.parquet"), recursive=True)
+    size_mb = sum(os.path.getsize(f) for f in shard_files + [national_path]) / (1024 * 1024)
+    print(f"Saved state-partitioned parquet dataset to {output_path} and national sums to {national_path}")
     print(f"Size: {size_mb:.2f} MB")
 
+def create_geo_assets():
+    """Convert us_places.geojson to GeoParquet and precompute per-state map centers."""
+    geo_path = os.path.join(OUTPUT_DIR, "us_places.geojson")
+    if not os.path.exists(geo_path):
+        print(f"{geo_path} not found.")
+        return
+
+    print("Converting places to GeoParquet...")
+    # pyogrio fills columns in C instead of going through Fiona's per-feature Python loop
+    gdf = pyogrio.read_dataframe(
+        geo_path, encoding='latin-1',
+        columns=['STATEFP', 'STUSPS', 'STATE_NAME', 'NAME', 'GEOID']
+    )
+    # Integer GEOID matches the key stored with the crime data
+    gdf['GEOID'] = gdf['GEOID'].astype('int32')
+    gdf.to_parquet(os.path.join(OUTPUT_DIR, "us_places.parquet"), index=False)
+
+    # One GeoJSON per state; the dashboard hands it to Plotly without serializing geometries
+    places_dir = os.path.join(OUTPUT_DIR, "places")
+    os.makedirs(places_dir, exist_ok=True)
+    for fp, rows in gdf.groupby('STATEFP').indices.items():
+        with open(os.path.join(places_dir, f"places_{fp}.json"), 'w') as fh:
+            fh.write(gdf.iloc[rows][['GEOID', 'geometry']].to_json(drop_id=True))
+
+    # The state map centers on the mean place point; GEOS work stays here, off the render path.
+    # representative_point() is always inside the polygon and, unlike centroid, is well-defined in lon/lat.
+    rep_points = gdf.geometry.representative_point()
+    centers = pd.DataFrame({
+        'STATEFP': gdf['STATEFP'],
+        'center_lat': rep_points.y.astype('float32'),
+        'center_lon': rep_points.x.astype('float32'),
+    }).groupby('STATEFP', sort=False).mean().reset_index()
+    centers.to_parquet(os.path.join(OUTPUT_DIR, "state_centers.parquet"), index=False)
+    print(f"Saved places and {len(centers)} state centers to {OUTPUT_DIR}")
+
 if __name__ == "__main__":
     create_optimized_dataset()
+    create_geo_assets()
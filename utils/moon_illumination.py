@@ -17,16 +17,24 @@ from __future__ import annotations
 import argparse
 import calendar
 import datetime as dt
-import html as htmllib
+import json
 import re
+import threading
 import time
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from lxml import etree
+from lxml import html as lxhtml
 
 USNO_URL = "https://aa.usno.navy.mil/calculated/moon/fraction"
 MONTHS = list(range(1, 13))
+CACHE_DIR = ".usno_cache"
+MAX_WORKERS = 4  # concurrent year requests; keep it polite
 
 # Minimal state->timezone mapping for demo (expand if needed)
 # tz_hours is the absolute magnitude; tz_sign: -1 means west (UTC minus), +1 means east (UTC plus).
@@ -57,29 +65,27 @@ def build_params(year: int, tz_hours: float, tz_sign: int, tz_label: str = "fals
 def html_to_text_preserve_table(html: str) -> str:
     """
     Convert HTML to parseable text while preserving table cell/row boundaries.
-    Critical: convert </td>, </th> to spaces and </tr> to newlines BEFORE stripping tags.
+    Parsed once by lxml: cells end with a space, rows/<br>/<p> end with a newline, then the
+    tree's text is read in one pass (entities are decoded by the parser).
     """
-    html = htmllib.unescape(html)
-
-    # Preserve table structure
-    html = re.sub(r"(?i)</(td|th)>", " ", html)     # cell boundary -> space
-    html = re.sub(r"(?i)</tr>", "\n", html)         # row boundary -> newline
-    html = re.sub(r"(?i)<br\s*/?>", "\n", html)
-    html = re.sub(r"(?i)</p>", "\n", html)
+    doc = lxhtml.fromstring(html)
 
     # Remove scripts/styles
-    html = re.sub(r"(?is)<script\b[^>]*>.*?</script>", "", html)
-    html = re.sub(r"(?is)<style\b[^>]*>.*?</style>", "", html)
+    etree.strip_elements(doc, "script", "style", with_tail=False)
+
+    # Preserve table structure
+    for el in doc.iter("td", "th", "tr", "br", "p"):
+        sep = " " if el.tag in ("td", "th") else "\n"
+        el.tail = sep + (el.tail or "")
 
-    # Strip remaining tags
-    html = re.sub(r"<[^>]+>", "", html)
+    text = doc.text_content()
 
     # Normalize whitespace
-    html = html.replace("\r\n", "\n").replace("\r", "\n")
-    html = re.sub(r"[ \t]+", " ", html)
-    html = re.sub(r"\n{2,}", "\n", html)
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n{2,}", "\n", text)
 
-    return html.strip()
+    return text.strip()
 
 
 DAY_START_RE = re.compile(r"^\s*(\d{2})\s+(.*)$")   # "01 0.48 0.58"
@@ -150,13 +156,126 @@ def fetch_year_html(session: requests.Session, year: int, tz_hours: float, tz_si
     raise RuntimeError(f"Failed to fetch year={year}: {last_err}")
 
 
+class DiskCache:
+    """
+    One file per key under `root`: get(key) returns the stored text or None, set(key, value) stores it.
+    Keys carry their own suffix (".html" for raw pages, ".json" for parsed aggregates).
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+
+    def get(self, key: str) -> Optional[str]:
+        path = self.root / key
+        return path.read_text(encoding="utf-8") if path.exists() else None
+
+    def set(self, key: str, value: str) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / (key + ".tmp")
+        tmp.write_text(value, encoding="utf-8")
+        tmp.replace(self.root / key)
+
+
+class RequestSpacer:
+    """
+    Keeps live requests at least `interval` seconds apart across worker threads.
+    Cached years never call wait(), so they are not slowed down.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def cache_key(year: int, tz_hours: float, tz_sign: int, tz_label: str) -> str:
+    return f"{year}_tz{tz_hours:.2f}_{tz_sign:+d}_{tz_label}"
+
+
+def aggregate_year(raw_html: str, year: int, debug: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Parse one year's page into per-month (sum of daily fractions, count of valid days), Jan..Dec.
+    """
+    text = html_to_text_preserve_table(raw_html)
+    lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
+
+    if debug:
+        print("DEBUG: first 40 non-empty lines after HTML->text:")
+        for ln in lines[:40]:
+            print(ln)
+
+    day_rows = parse_wrapped_day_rows(lines, debug=debug)
+    if len(day_rows) < 28:
+        raise RuntimeError(
+            f"Parsing failed for {year}: only {len(day_rows)} day-rows reconstructed. "
+            "Run with --debug to inspect."
+        )
+
+    # (day rows, 12 months) with NaN for "--"; a cell counts if the value exists and the date does
+    vals = np.array([[np.nan if v is None else v for v in row] for _, row in day_rows], dtype=np.float64)
+    days = np.array([day for day, _ in day_rows])
+    month_len = np.array([calendar.monthrange(year, m)[1] for m in MONTHS])
+    mask = ~np.isnan(vals) & (days[:, None] >= 1) & (days[:, None] <= month_len[None, :])
+
+    bad = mask & ~((vals >= 0.0) & (vals <= 1.0))
+    if bad.any():
+        i, j = np.argwhere(bad)[0]
+        raise RuntimeError(f"Value out of [0,1] for {year}-{j + 1:02d}-{days[i]:02d}: {vals[i, j]}")
+
+    return np.where(mask, vals, 0.0).sum(axis=0), mask.sum(axis=0).astype(np.int32)
+
+
+def load_year(session: requests.Session, cache: DiskCache, year: int, tz_hours: float, tz_sign: int,
+              tz_label: str, refresh: bool = False, debug: bool = False,
+              spacer: Optional[RequestSpacer] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Per-month aggregates for one year, served from the disk cache when possible.
+    Past years never change, so only they are cached; the current (partial) year is always fetched.
+    `refresh` ignores what is cached and overwrites it.
+    """
+    key = cache_key(year, tz_hours, tz_sign, tz_label)
+    cacheable = year < dt.date.today().year
+    use_cached = cacheable and not refresh
+
+    if use_cached and not debug:
+        cached = cache.get(key + ".json")
+        if cached is not None:
+            agg = json.loads(cached)
+            return np.array(agg["sums"], dtype=np.float64), np.array(agg["counts"], dtype=np.int32)
+
+    raw_html = cache.get(key + ".html") if use_cached else None
+    fetched = raw_html is None
+    if fetched:
+        if spacer is not None:
+            spacer.wait()
+        raw_html = fetch_year_html(session, year=year, tz_hours=tz_hours, tz_sign=tz_sign, tz_label=tz_label)
+
+    sums, counts = aggregate_year(raw_html, year, debug=debug)
+    # Only a page that parsed is cached: a 200 error/maintenance page must not stick until --refresh
+    if cacheable:
+        if fetched:
+            cache.set(key + ".html", raw_html)
+        cache.set(key + ".json", json.dumps({"sums": sums.tolist(), "counts": counts.tolist()}))
+    return sums, counts
+
+
 def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--start", type=int, default=2012)
     ap.add_argument("--end", type=int, default=2024)
     ap.add_argument("--out", type=str, default="usno_moon_monthly_2012_2024.csv")
-    ap.add_argument("--sleep", type=float, default=0.15, help="Seconds between year requests.")
+    ap.add_argument("--sleep", type=float, default=0.15, help="Minimum seconds between live year requests.")
     ap.add_argument("--debug", action="store_true", help="Print diagnostics for the first year.")
+    ap.add_argument("--cache-dir", type=str, default=CACHE_DIR, help="Where fetched pages and parsed years are kept.")
+    ap.add_argument("--refresh", action="store_true", help="Ignore the cache and re-fetch every year.")
 
     # Time zone selection
     ap.add_argument("--state", type=str, default=None, help="Two-letter state code for demo TZ, e.g., AL.")
@@ -182,63 +301,46 @@ def main() -> None:
         tz_sign = int(args.tz_sign)
         tz_label = args.tz_label
 
-    # Aggregators
-    sum_by_month = defaultdict(float)  # (year, month) -> sum of daily fractions
-    n_by_month = defaultdict(int)      # (year, month) -> count of valid days
+    # Aggregators: row = year - start, column = month - 1
+    years = list(range(args.start, args.end + 1))
+    sums = np.zeros((len(years), 12), dtype=np.float64)  # sum of daily fractions
+    counts = np.zeros((len(years), 12), dtype=np.int32)  # count of valid days
+    cache = DiskCache(args.cache_dir)
+    spacer = RequestSpacer(args.sleep)
+
+    def run_year(year: int) -> Tuple[np.ndarray, np.ndarray]:
+        return load_year(session, cache, year, tz_hours=tz_hours, tz_sign=tz_sign, tz_label=tz_label,
+                         refresh=args.refresh, debug=(args.debug and year == args.start), spacer=spacer)
 
+    # Requests are latency-bound: a few in flight over one pooled session (connections/TLS are reused)
     with requests.Session() as session:
-        for year in range(args.start, args.end + 1):
-            raw_html = fetch_year_html(session, year=year, tz_hours=tz_hours, tz_sign=tz_sign, tz_label=tz_label)
-            text = html_to_text_preserve_table(raw_html)
-            lines = [ln.strip() for ln in text.split("\n") if ln.strip()]
-
-            if args.debug and year == args.start:
-                print("DEBUG: first 40 non-empty lines after HTML->text:")
-                for ln in lines[:40]:
-                    print(ln)
-
-            day_rows = parse_wrapped_day_rows(lines, debug=(args.debug and year == args.start))
-            if len(day_rows) < 28:
-                raise RuntimeError(
-                    f"Parsing failed for {year}: only {len(day_rows)} day-rows reconstructed. "
-                    "Run with --debug to inspect."
-                )
-
-            for day, vals in day_rows:
-                for month, val in zip(MONTHS, vals):
-                    if val is None:
-                        continue
-                    # Validate date exists
-                    try:
-                        _ = dt.date(year, month, day)
-                    except ValueError:
-                        continue
-                    if not (0.0 <= val <= 1.0):
-                        raise RuntimeError(f"Value out of [0,1] for {year}-{month:02d}-{day:02d}: {val}")
-                    sum_by_month[(year, month)] += val
-                    n_by_month[(year, month)] += 1
-
-            time.sleep(args.sleep)
+        adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            for yidx, (year_sums, year_counts) in enumerate(ex.map(run_year, years)):
+                sums[yidx] = year_sums
+                counts[yidx] = year_counts
 
     # Completeness checks
-    for year in range(args.start, args.end + 1):
-        for month in MONTHS:
-            expected_days = calendar.monthrange(year, month)[1]
-            got_days = n_by_month.get((year, month), 0)
-            if got_days != expected_days:
-                raise RuntimeError(
-                    f"Day count mismatch for {year}-{month:02d}: expected {expected_days}, got {got_days}."
-                )
+    expected = np.array([[calendar.monthrange(year, m)[1] for m in MONTHS] for year in years])
+    mismatch = np.argwhere(counts != expected)
+    if len(mismatch):
+        yidx, midx = mismatch[0]
+        raise RuntimeError(
+            f"Day count mismatch for {years[yidx]}-{midx + 1:02d}: expected {expected[yidx, midx]}, got {counts[yidx, midx]}."
+        )
 
     # Write output
     expected_months = (args.end - args.start + 1) * 12
     with open(args.out, "w", encoding="utf-8") as f:
         f.write("year_month,year,month,moon_fracillum_mean,n_days,tz_hours,tz_sign,state\n")
         state_written = args.state.strip().upper() if args.state else ""
-        for year in range(args.start, args.end + 1):
+        means = sums / counts
+        for yidx, year in enumerate(years):
             for month in MONTHS:
-                n = n_by_month[(year, month)]
-                mean = sum_by_month[(year, month)] / n
+                n = counts[yidx, month - 1]
+                mean = means[yidx, month - 1]
                 f.write(f"{year}-{month:02d},{year},{month},{mean:.6f},{n},{tz_hours:.2f},{tz_sign},{state_written}\n")
 
     print(f"Wrote: {args.out}")